@@ -0,0 +1,116 @@
+import os, sys, json, time, random, hashlib, argparse, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+LIVE_HOST = "https://api.nhs.uk"
+
+class RecordedAPI:
+    """Responses recorded by NHS-medicines-scraper.py in its http_cache, looked up by path and query."""
+    def __init__(self, fixtures):
+        self.objects_dir = os.path.join(fixtures, "objects")
+        with open(os.path.join(fixtures, "index.json"), 'r', encoding='utf-8') as json_file:
+            index = json.load(json_file)
+        self.routes = {}
+        for key, entry in index.items():
+            parts = urlsplit(key)
+            self.routes[self.route(parts.path, parts.query)] = entry["sha256"]
+        print(f"Loaded {len(self.routes)} recorded responses from {fixtures}")
+
+    def route(self, path, query):
+        # same normalisation as ResponseCache.key, minus the host
+        params = sorted((k, v) for k, v in parse_qsl(query) if k != "subscription-key")
+        return f"{path.rstrip('/')}?{urlencode(params)}" if params else path.rstrip('/')
+
+    def lookup(self, path, query):
+        sha256 = self.routes.get(self.route(path, query))
+        if sha256 is None:
+            return None, None
+        with open(os.path.join(self.objects_dir, f"{sha256}.json"), 'rb') as body_file:
+            return sha256, body_file.read()
+
+def make_handler(api, latency, jitter, error_rate, error_statuses, seed):
+    counts = {}
+    counts_lock = threading.Lock()
+
+    def request_rng(path):
+        # seeded per route and per request to it, so concurrent clients get the same draws whatever order they arrive in
+        with counts_lock:
+            counts[path] = counts.get(path, 0) + 1
+            count = counts[path]
+        digest = hashlib.sha256(f"{seed}\0{path}\0{count}".encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+    class StandInHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            rng = request_rng(api.route(parts.path, parts.query))
+            time.sleep(max(0.0, rng.gauss(latency, jitter)))
+
+            if rng.random() < error_rate:
+                status = rng.choice(error_statuses)
+                self.send_response(status)
+                if status in (429, 503):
+                    self.send_header("Retry-After", "1")
+                self.end_headers()
+                return
+
+            sha256, body = api.lookup(parts.path, parts.query)
+            if body is None:
+                self.send_error(404, "No recorded response")
+                return
+
+            etag = f'"{sha256}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+
+            if parts.path.rstrip('/') == "/medicines":
+                body = self.rewrite_links(body)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def rewrite_links(self, body):
+            # point medicine links in the list back at this server instead of the live API
+            results = json.loads(body)
+            for object in results.get("significantLink", []):
+                object["url"] = object["url"].replace(LIVE_HOST, f"http://{self.headers['Host']}")
+            return json.dumps(results).encode()
+
+        def log_message(self, format, *args):
+            pass
+
+    return StandInHandler
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the NHS Medicines API serving recorded responses")
+    parser.add_argument("--fixtures", default="testdata/NHSmed/scraper_state/http_cache", help="http_cache folder recorded by the scraper")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="mean response delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="standard deviation of the response delay in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with an injected error")
+    parser.add_argument("--error-statuses", default="429,503", help="comma separated statuses used for injected errors")
+    parser.add_argument("--seed", type=int, default=None, help="seed latency and error injection, drawn per route and request count so runs repeat under concurrency")
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.fixtures, "index.json")):
+        print(f"No recorded responses found in {args.fixtures}")
+        sys.exit(1)
+    # without --seed pick one, printed so a run can be repeated
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    print(f"Latency and error injection seed: {seed}")
+
+    api = RecordedAPI(args.fixtures)
+    error_statuses = [int(status) for status in args.error_statuses.split(",")]
+    handler = make_handler(api, args.latency, args.jitter, args.error_rate, error_statuses, seed)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), handler)
+    print(f"Serving NHS Medicines API stand-in on http://127.0.0.1:{args.port}/medicines")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
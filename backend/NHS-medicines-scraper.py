@@ -1,17 +1,194 @@
-import sys, os, time, requests, markdownify, re, json
+import sys, os, time, requests, markdownify, re, json, threading, argparse, random, hashlib
+from urllib.parse import urlencode
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 from langchain.docstore.document import Document
+from corpus import CorpusStore, CORPUS_DB, DOCUMENT_EXTENSIONS
 from dotenv import load_dotenv
 load_dotenv()
 
+class TokenBucket:
+    """Blocking token bucket shared by all worker threads to stay within the API quota."""
+    def __init__(self, rate, capacity=1):
+        self.rate = rate # tokens per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+                self.timestamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class ResponseCache:
+    """Content-addressed store of API response bodies plus the ETag/Last-Modified validators for each URL."""
+    def __init__(self, folder):
+        self.folder = folder
+        self.objects_dir = os.path.join(folder, "objects")
+        self.index_path = os.path.join(folder, "index.json")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as json_file:
+                self.index = json.load(json_file)
+
+    def key(self, url, params):
+        # the subscription key must not end up in the cache index
+        public = sorted((k, v) for k, v in params.items() if k != "subscription-key")
+        return f"{url}?{urlencode(public)}" if public else url
+
+    def conditional_headers(self, key):
+        entry = self.index.get(key, {})
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def load(self, key):
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        return self._read(entry["sha256"])
+
+    def _read(self, sha256):
+        # a body that doesn't match its hash, torn by a crash mid-write, is a miss so it gets fetched again
+        path = os.path.join(self.objects_dir, f"{sha256}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as body_file:
+            body = body_file.read()
+        return body if hashlib.sha256(body).hexdigest() == sha256 else None
+
+    def store(self, key, response):
+        body = response.content
+        sha256 = hashlib.sha256(body).hexdigest()
+        if self._read(sha256) is None:
+            # write then rename, per thread as workers can fetch the same body at once
+            path = os.path.join(self.objects_dir, f"{sha256}.json")
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as body_file:
+                body_file.write(body)
+            os.replace(tmp_path, path)
+        with self.lock:
+            self.index[key] = {
+                "sha256": sha256,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+            # write then rename so a crash never leaves a truncated index
+            with open(self.index_path + ".tmp", 'w', encoding='utf-8') as json_file:
+                json.dump(self.index, json_file, ensure_ascii=False, indent=4)
+            os.replace(self.index_path + ".tmp", self.index_path)
+
+class CheckpointJournal:
+    """Append-only record of completed list pages and medications so a crashed run can resume."""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.pages = {}
+        self.medications = {}
+        self.last_page = None
+        self.list_complete = False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as journal_file:
+                for line in journal_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break # torn final line from a crash mid-write
+                    self._apply(record)
+
+    def _apply(self, record):
+        if record["type"] == "page":
+            self.pages[record["page"]] = record["links"]
+            if record.get("last_page") is not None:
+                self.last_page = record["last_page"]
+        elif record["type"] == "list_complete":
+            self.list_complete = True
+        elif record["type"] == "medication":
+            self.medications[record["name"]] = {"dateModified": record["dateModified"], "output_name": record["output_name"]}
+
+    def _append(self, record):
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as journal_file:
+                journal_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+            self._apply(record)
+
+    def record_page(self, page, links, last_page=None):
+        self._append({"type": "page", "page": page, "links": links, "last_page": last_page})
+
+    def record_list_complete(self):
+        self._append({"type": "list_complete"})
+
+    def record_medication(self, med, output_name):
+        self._append({"type": "medication", "name": med["name"], "dateModified": med["dateModified"], "output_name": output_name})
+
+    def is_complete(self, med):
+        entry = self.medications.get(med["name"])
+        return entry is not None and entry["dateModified"] == med["dateModified"]
+
+    def clear(self):
+        with self.lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.pages, self.medications, self.last_page, self.list_complete = {}, {}, None, False
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
 class NHSMedicationAPI:
     def __init__(self):
         load_dotenv()
         self.api_key = self._load_api_key()
-        self.base_url = "https://api.nhs.uk/medicines"
+        self.base_url = os.getenv("NHS_API_BASE_URL", "https://api.nhs.uk/medicines")
         self.base_params = {
             "subscription-key": self.api_key,
         }
-        self.date_last_run = os.getenv("DATE_LAST_RUN")
+        self.date_last_run = os.getenv("DATE_LAST_RUN") # ISO 8601, used when no manifest exists yet
+        self.output_dir = "testdata/NHSmed"
+        # scraper bookkeeping lives in a subfolder so InitialiseRAG.load_documents doesn't read it as documents
+        self.state_dir = os.path.join(self.output_dir, "scraper_state")
+        self.manifest_path = os.path.join(self.state_dir, "manifest.json")
+        self.rate_limit = float(os.getenv("NHS_API_RATE_LIMIT", 10)) # requests per minute for subscription tier
+        self.max_workers = int(os.getenv("NHS_API_WORKERS", 4))
+        self.limiter = TokenBucket(self.rate_limit / 60, capacity=int(os.getenv("NHS_API_BURST", 1)))
+        self.request_count = 0
+        self.stats_lock = threading.Lock()
+        self.max_retries = int(os.getenv("NHS_API_MAX_RETRIES", 5))
+        self.backoff_base = float(os.getenv("NHS_API_BACKOFF_BASE", 2)) # seconds, doubled each retry
+        self.backoff_cap = 120
+        self.session = self._create_session()
+        self.failed_pages = []
+        self.failed_medications = []
+        self.offline = False # replay responses from the cache without touching the network
+        self.cache = ResponseCache(os.path.join(self.state_dir, "http_cache"))
+        self.journal = CheckpointJournal(os.path.join(self.state_dir, "journal.jsonl"))
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.store = CorpusStore(os.path.join(self.output_dir, CORPUS_DB))
+        self.indexer = None # optional rag_index.StreamingIndexer fed with each medication's documents
+
+    def _create_session(self):
+        # one pooled keep-alive connection per worker, retries are handled in _get so they respect the limiter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
 
     def _load_api_key(self):
         if "NHS_API_KEY" in os.environ:
@@ -21,67 +198,277 @@ class NHSMedicationAPI:
             print("NHS API Key Missing from .env")
             sys.exit()
 
+    def _get(self, url, params, headers=None):
+        for attempt in range(self.max_retries + 1):
+            # every API call waits for a token so workers saturate the quota without exceeding it
+            self.limiter.acquire()
+            with self.stats_lock:
+                self.request_count += 1
+            try:
+                response = self.session.get(url, params=params, headers=headers, timeout=30)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._backoff_delay(attempt)
+                print(f"{e.__class__.__name__} for {url}, retrying in {delay:.1f}s")
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    return response
+                delay = self._retry_after(response) or self._backoff_delay(attempt)
+                print(f"HTTP {response.status_code} for {url}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    def _get_json(self, url, params):
+        key = self.cache.key(url, params)
+        if self.offline:
+            body = self.cache.load(key)
+            if body is None:
+                raise requests.exceptions.RequestException(f"No cached response for {key}")
+            return json.loads(body)
+        
+        response = self._get(url, params, headers=self.cache.conditional_headers(key))
+        if response.status_code == 304:
+            body = self.cache.load(key)
+            if body is not None:
+                return json.loads(body)
+            response = self._get(url, params) # validators outlived the cached body
+        response.raise_for_status()
+        self.cache.store(key, response)
+        return response.json()
+
+    def _backoff_delay(self, attempt):
+        # full jitter so concurrent workers don't retry in lockstep
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def _retry_after(self, response):
+        value = response.headers.get("Retry-After")
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+    def _report_throughput(self, start, requests_before):
+        elapsed = time.monotonic() - start
+        made = self.request_count - requests_before
+        rate = made / elapsed if elapsed > 0 else 0.0
+        print(f"{made} requests in {elapsed:.1f}s ({rate:.3f} requests/s, limit {self.rate_limit / 60:.3f} requests/s)")
+
     def get_medication_list(self):
+        if self.journal.list_complete:
+            print("Resuming interrupted run, medication list already complete")
+            return
+        
         medication_table = {"data": []}
-        prev_page_medication = ""
+        pages = dict(self.journal.pages)
+        start, requests_before = time.monotonic(), self.request_count
+        if pages:
+            print(f"Resuming interrupted run, {len(pages)} list pages already fetched")
         
-        for page in range(1, 100):
-            try:
-                self.base_params["page"] = page
-                response = requests.get(self.base_url, params=self.base_params)
-                response.raise_for_status()
-                results = response.json()
-                
-                if prev_page_medication == results["significantLink"][-1]["name"]:
-                    break
-                
-                for object in results["significantLink"]:
-                    name, url, dateModified = object["name"], object["url"], object["mainEntityOfPage"]["dateModified"]
-                    medication_table["data"].append({"name": name, "url": url, "dateModified": dateModified})
-                    print(f"Drug: {name}, URL: {url}, Date Modified: {dateModified}")
-                    prev_page_medication = name
-            except requests.exceptions.RequestException as e:
-                print(f"Error occurred while fetching medication list: {e}")
-            except ValueError as e:
-                print(f"Error occurred while parsing JSON response for medication list: {e}")
-            except Exception as e:
-                print(f"An unexpected error occurred for API request to medication list: {e}")
+        # the first page tells us how many pages there are when the API includes pagination links
+        if 1 not in pages:
+            results = self._fetch_list_page(1)
+            if results is None:
+                self.failed_pages.append(1)
+                print("Unable to fetch the first page of the medication list")
+                return
+            pages[1] = results["significantLink"]
+            self.journal.record_page(1, pages[1], self._last_page(results))
+        last_page = self.journal.last_page
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            if last_page is not None:
+                todo = [page for page in range(2, last_page + 1) if page not in pages]
+                for page, results in zip(todo, executor.map(self._fetch_list_page, todo)):
+                    self._collect_list_page(page, results, pages)
+            else:
+                self._probe_list_pages(executor, pages)
             
-            time.sleep(7)
+            # second chance for pages that failed after all retries
+            retry, self.failed_pages = self.failed_pages, []
+            if retry:
+                print(f"Retrying medication list pages {retry}")
+            for page, results in zip(retry, executor.map(self._fetch_list_page, retry)):
+                self._collect_list_page(page, results, pages)
         
+        for page in sorted(pages):
+            for object in pages[page]:
+                name, url, dateModified = object["name"], object["url"], object["mainEntityOfPage"]["dateModified"]
+                medication_table["data"].append({"name": name, "url": url, "dateModified": dateModified})
+                print(f"Drug: {name}, URL: {url}, Date Modified: {dateModified}")
+        
+        self._report_throughput(start, requests_before)
         self._save_medication_table(medication_table)
+        if not self.failed_pages:
+            self.journal.record_list_complete()
+
+    def _last_page(self, results):
+        # pagination is advertised as relatedLink entries such as {"name": "Last Page", "url": "...?page=27"}
+        for link in results.get("relatedLink", []):
+            if link.get("name") == "Last Page":
+                match = re.search(r'[?&]page=(\d+)', link.get("url", ""))
+                if match:
+                    return int(match.group(1))
+        return None
+
+    def _has_next_page(self, results):
+        links = results.get("relatedLink")
+        if not links:
+            return None # unknown, the API didn't send pagination links
+        return any(link.get("name") == "Next Page" for link in links)
+
+    def _collect_list_page(self, page, results, pages):
+        if results is None:
+            self.failed_pages.append(page)
+            return
+        pages[page] = results["significantLink"]
+        self.journal.record_page(page, pages[page])
+
+    def _probe_list_pages(self, executor, pages):
+        # without a last page link, fetch a window of pages ahead at a time and stop at the first terminal page
+        has_next = {}
+        page = 2
+        while page < 100:
+            window = list(range(page, min(page + self.max_workers, 100)))
+            todo = [p for p in window if p not in pages]
+            for p, results in zip(todo, executor.map(self._fetch_list_page, todo)):
+                if results is not None:
+                    has_next[p] = self._has_next_page(results)
+                self._collect_list_page(p, results, pages)
+            
+            for p in window:
+                if p not in pages:
+                    continue
+                # an empty page or a repeat of the previous page means we've run off the end
+                repeated = pages[p] and pages.get(p - 1) and pages[p][-1]["name"] == pages[p - 1][-1]["name"]
+                if not pages[p] or repeated:
+                    self._discard_list_pages(pages, p)
+                    return
+                if has_next.get(p) is False:
+                    self._discard_list_pages(pages, p + 1)
+                    return
+            page = window[-1] + 1
+
+    def _discard_list_pages(self, pages, first):
+        for p in [p for p in pages if p >= first]:
+            del pages[p]
+        self.failed_pages = [p for p in self.failed_pages if p < first]
+
+    def _fetch_list_page(self, page):
+        try:
+            params = {**self.base_params, "page": page}
+            return self._get_json(self.base_url, params)
+        except requests.exceptions.RequestException as e:
+            print(f"Error occurred while fetching medication list: {e}")
+        except ValueError as e:
+            print(f"Error occurred while parsing JSON response for medication list: {e}")
+        except Exception as e:
+            print(f"An unexpected error occurred for API request to medication list: {e}")
+        return None
 
     def _save_medication_table(self, medication_table):
-        with open('testdata/NHSmed/medication_table.json', 'w', encoding='utf-8') as json_file:
+        with open(os.path.join(self.output_dir, 'medication_table.json'), 'w', encoding='utf-8') as json_file:
             json.dump(medication_table, json_file, ensure_ascii=False, indent=4)
 
     def load_med_list(self):
-        with open('testdata/NHSmed/medication_table.json', 'r', encoding='utf-8') as json_file:
+        with open(os.path.join(self.output_dir, 'medication_table.json'), 'r', encoding='utf-8') as json_file:
+            return json.load(json_file)
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, 'r', encoding='utf-8') as json_file:
             return json.load(json_file)
 
-    def get_all_medications(self, medication_table):
-        for med in medication_table["data"]:
-            self._process_medication(med)
+    def _save_manifest(self, manifest):
+        os.makedirs(self.state_dir, exist_ok=True)
+        with open(self.manifest_path, 'w', encoding='utf-8') as json_file:
+            json.dump(manifest, json_file, ensure_ascii=False, indent=4)
+
+    def _is_unchanged(self, med, manifest):
+        if med["name"] in manifest:
+            return manifest[med["name"]]["dateModified"] == med["dateModified"]
+        # no manifest from an earlier run, fall back to DATE_LAST_RUN for files already on disk
+        if self.date_last_run and os.path.exists(os.path.join(self.output_dir, f"{med['name']}.md")):
+            return med["dateModified"] <= self.date_last_run
+        return False
+
+    def _delete_outputs(self, name):
+        self.store.delete_medicine(name)
+        for ext in (".md", ".json") + DOCUMENT_EXTENSIONS:
+            path = os.path.join(self.output_dir, f"{name}{ext}")
+            if os.path.exists(path):
+                os.remove(path)
+        if self.indexer is not None:
+            self.indexer.submit(name, [])
+        print(f"Removed outputs for {name}")
+
+    def get_all_medications(self, medication_table, incremental=True):
+        # loaded even for a full run, removals are worked out from it and the journal is merged into it
+        manifest = self.load_manifest()
+        to_process = [med for med in medication_table["data"] if not (incremental and self._is_unchanged(med, manifest))]
+        resumed = [med for med in to_process if self.journal.is_complete(med)]
+        if resumed:
+            print(f"Resuming interrupted run, {len(resumed)} medications already written")
+            to_process = [med for med in to_process if not self.journal.is_complete(med)]
+        current = {med["name"] for med in medication_table["data"]}
+        # a partial medication list can't tell us what was removed
+        if not self.failed_pages:
+            for name in [name for name in manifest if name not in current]:
+                self._delete_outputs(manifest.pop(name)["output_name"])
+            # medicines left in the corpus without a manifest entry, by earlier full runs that started from an empty manifest
+            for name in [name for name in self.store.medicine_names() if name not in current]:
+                self._delete_outputs(name)
+        print(f"{len(to_process)} of {len(medication_table['data'])} medications new or modified")
+
+        start, requests_before = time.monotonic(), self.request_count
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            output_names = list(executor.map(self._process_and_checkpoint, to_process))
+            # second chance for medications that failed after all retries
+            retry = [i for i, output_name in enumerate(output_names) if output_name is None]
+            if retry:
+                print(f"Retrying {len(retry)} failed medications")
+            for i, output_name in zip(retry, executor.map(self._process_and_checkpoint, [to_process[i] for i in retry])):
+                output_names[i] = output_name
+        self._report_throughput(start, requests_before)
+        self.failed_medications = [med["name"] for med, output_name in zip(to_process, output_names) if output_name is None]
+
+        # the journal holds everything written by this run and any interrupted run before it
+        manifest.update(self.journal.medications)
+        self._save_manifest(manifest)
+        self.journal.clear()
+
+    def _process_and_checkpoint(self, med):
+        output_name = self._process_medication(med)
+        if output_name is not None:
+            self.journal.record_medication(med, output_name)
+        return output_name
 
     def _process_medication(self, med):
         url = med["url"]
         try:
-            response = requests.get(url, params=self.base_params)
-            response.raise_for_status()
-            results = response.json()
+            results = self._get_json(url, self.base_params)
             
             name, description, url = results['name'], results['description'], results['url']
             alternateName = " ".join(results['about']['alternateName'])
             
             
             whole_page = self._create_page_header(name, description, alternateName)
-            documentjson = {}
+            documents = {}
             
             for section in results['hasPart']:
-                whole_page, documentjson = self._process_section(section, name, description, alternateName, whole_page, documentjson)
+                whole_page, documents = self._process_section(section, name, description, alternateName, whole_page, documents)
             
             self._save_markdown(name, whole_page)
-            self._save_json(name, documentjson)
+            self._save_documents(name, med["dateModified"], url, description, alternateName, whole_page, list(documents.values()))
+            if self.indexer is not None:
+                self.indexer.submit(name, list(documents.values()))
+            return name
 
         except requests.exceptions.RequestException as e:
             print(f"Error occurred while fetching data for {med}: {e}")
@@ -89,8 +476,7 @@ class NHSMedicationAPI:
             print(f"Error occurred while parsing JSON response for {med}: {e}")
         except Exception as e:
             print(f"An unexpected error occurred for {med}: {e}")
-        
-        time.sleep(7)
+        return None
 
     def _create_page_header(self, name, description, alternateName):
         if alternateName == "":
@@ -98,7 +484,7 @@ class NHSMedicationAPI:
         else:
             return f"# {name} ({alternateName})\n\n## {description}\n\n"
 
-    def _process_section(self, section, name, description, alternateName, whole_page, documentjson):
+    def _process_section(self, section, name, description, alternateName, whole_page, documents):
         subdescription = section.get("description", "")
         headline = section.get("headline", "")
         apiurl = section.get("url", "")
@@ -114,10 +500,10 @@ class NHSMedicationAPI:
         titlefromurl = self._get_title_from_url(suburl, headline)
         
         doc = self._create_document(paragraph_content, name, suburl, alternateName, description, titlefromurl)
-        documentjson[titlefromurl] = doc.json()
+        documents[titlefromurl] = doc
         print(f"Document created for {name} - {titlefromurl}")
         
-        return whole_page, documentjson
+        return whole_page, documents
 
     def _create_paragraph_header(self, headline, subdescription):
         if headline == "":
@@ -163,22 +549,47 @@ class NHSMedicationAPI:
         )
 
     def _save_markdown(self, name, whole_page):
-        mdname = f"testdata/NHSmed/{name}.md"
+        mdname = os.path.join(self.output_dir, f"{name}.md")
         with open(mdname, 'w', encoding='utf-8') as md_file:
             md_file.write(whole_page)
             print(f"Markdown created for {name}")
 
-    def _save_json(self, name, documentjson):
-        file_name = f"testdata/NHSmed/{name}.json"
-        with open(file_name, 'w') as json_file:
-            json.dump(documentjson, json_file)
-            print(f"Document JSON created for {name}")
+    def _save_documents(self, name, dateModified, url, description, alternateName, whole_page, documents):
+        self.store.upsert_medicine(name, url, description, alternateName, dateModified, whole_page, documents)
+        # drop per-medication files from older scrapes so the loader doesn't see the medication twice
+        for ext in (".json",) + DOCUMENT_EXTENSIONS:
+            legacy = os.path.join(self.output_dir, f"{name}{ext}")
+            if os.path.exists(legacy):
+                os.remove(legacy)
+        print(f"Documents stored for {name}")
 
 def main():
+    parser = argparse.ArgumentParser(description="Scrape the NHS Medicines API into Markdown and Documents")
+    parser.add_argument("--full", action="store_true", help="re-download every medication, ignoring the manifest")
+    parser.add_argument("--offline", action="store_true", help="re-process every medication from the response cache without network access")
+    parser.add_argument("--base-url", help="medicines list endpoint, e.g. a local NHS-api-standin.py")
+    parser.add_argument("--index", action="store_true", help="chunk, embed and upsert each medication into the Chroma index as it is scraped")
+    args = parser.parse_args()
+
     api = NHSMedicationAPI()
+    api.offline = args.offline
+    if args.base_url:
+        api.base_url = args.base_url
+    if args.index:
+        from rag_index import StreamingIndexer # only needed when indexing, pulls in Chroma and the embedding model
+        api.indexer = StreamingIndexer()
     api.get_medication_list()
     medication_table = api.load_med_list()
-    api.get_all_medications(medication_table)
+    try:
+        api.get_all_medications(medication_table, incremental=not (args.full or args.offline))
+    finally:
+        if api.indexer is not None:
+            api.indexer.close()
+
+    # failed items are left out of the manifest so the next run picks them up
+    if api.failed_pages or api.failed_medications:
+        print(f"Scrape incomplete, failed list pages: {api.failed_pages}, failed medications: {api.failed_medications}")
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
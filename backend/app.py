@@ -21,6 +21,10 @@ def simple_message():
         "urls" : []
     }
   """
+  if RAGSystem.error is not None:
+    return {"status": "failed", "error": str(RAGSystem.error)}, 500
+  if not RAGSystem.ready.is_set():
+    return {"status": "warming up"}, 503, {"Retry-After": "10"}
   data = request.get_json()  # Access the JSON data from the request body
   input = data["input"]
   urls = None
@@ -37,26 +41,50 @@ def simple_message():
   data["urls"].append(urls)
   return data
 
+# Liveness, the process is up and warm-up hasn't failed, so the orchestrator restarts it if it has
+@app.route('/healthz', methods=['GET'])
+def healthz():
+  if RAGSystem.error is not None:
+    return {"status": "failed", "error": str(RAGSystem.error)}, 500
+  return {"status": "ok"}
+
+# Readiness, models and vector database are loaded
+@app.route('/readyz', methods=['GET'])
+def readyz():
+  if RAGSystem.ready.is_set():
+    return {"status": "ready", "rerank_cache": RAGSystem.reranker.cache.stats()}
+  if RAGSystem.error is not None:
+    return {"status": "failed", "error": str(RAGSystem.error)}, 503
+  return {"status": "warming up"}, 503, {"Retry-After": "10"}
+
 #############################
 ### Setup LLM and VectorDB ##
 #############################
 
 import os
 import sys
-import json
+import time
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
 from langchain.docstore.document import Document
-from langchain_community.embeddings import HuggingFaceEmbeddings
   
 class InitialiseRAG:
     def __init__(self):
         self.setup_environment()
-        self.local_llm = self.setup_llm()
+        self.local_llm = None
+        # forked now, before the warm-up thread and Flask start any threads, as forking a threaded process can deadlock
+        self.ingest_pool = self.ingest_executor()
         self.vectorstore = None
         self.retriever = None
+        self.multi_retriever = None
+        self.self_retriever = None
+        self.reranker = None
+        self.matcher = None
+        self.ready = threading.Event()
+        self.error = None
 
     def setup_environment(self):
         load_dotenv()
@@ -67,66 +95,138 @@ class InitialiseRAG:
             sys.exit(1)
 
     def setup_llm(self):
+        # langchain_openai imports the openai SDK, so it is loaded in the warm-up thread too
+        from langchain_openai import ChatOpenAI
         return ChatOpenAI(temperature=0, model="gpt-4-turbo", streaming=True)
 
-    def load_documents(self, folder):
+    # corpus and rag_index pull in Chroma, the embedding model, tiktoken and numpy, so the methods below
+    # import them in the warm-up thread rather than before Flask binds
+    def load_documents(self, folder, executor=None):
+        from corpus import CORPUS_DB, CorpusStore, is_document_file, load_document_file, load_medicines
         doc_list = []
-        for filename in os.listdir(folder):
-            if filename.endswith(".json") and filename != "medication_table.json":
-                file_path = os.path.join(folder, filename)
-                try:
-                    with open(file_path, 'r') as json_file:
-                        dict = json.load(json_file)
-                        for obj in dict.values():
-                            obj = json.loads(obj)
-                            doc = Document(**obj)
-                            doc_list.append(doc)
-                    print(f"Loaded Medication: {filename}")
-                except FileNotFoundError:
-                    print(f"Error: Medication file not found: {filename}")
-                except json.JSONDecodeError:
-                    print(f"Error: Invalid JSON format in medication file: {filename}")
+        db_path = os.path.join(folder, CORPUS_DB)
+        if os.path.exists(db_path):
+            store = CorpusStore(db_path)
+            if executor is None:
+                doc_list.extend(store.iter_documents())
+            else:
+                # each worker reads a batch of medicines, map keeps them in order
+                names = store.medicine_names()
+                batches = [names[start:start + 16] for start in range(0, len(names), 16)]
+                for docs in executor.map(load_medicines, [db_path] * len(batches), batches):
+                    doc_list.extend(docs)
+            store.close()
+            print(f"Loaded {len(doc_list)} Documents from {db_path}")
+        # per-medication files left by older versions of the scraper
+        filenames = [filename for filename in sorted(os.listdir(folder)) if is_document_file(filename)]
+        paths = [os.path.join(folder, filename) for filename in filenames]
+        loader = map if executor is None else executor.map
+        for filename, docs in zip(filenames, loader(load_document_file, paths)):
+            if docs is not None:
+                doc_list.extend(docs)
+                print(f"Loaded Medication: {filename}")
         return doc_list
 
-    def split_documents(self, doc_list):
-        text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-            chunk_size=512, 
-            chunk_overlap=64,
-        )
-        return text_splitter.split_documents(doc_list)
+    def corpus_fingerprint(self, folder, embedding_version):
+        # cheap to compute: content hashes from the corpus database, size and mtime of any legacy files
+        from corpus import CORPUS_DB, CorpusStore, is_document_file
+        from rag_index import index_fingerprint
+        digest = hashlib.sha256()
+        db_path = os.path.join(folder, CORPUS_DB)
+        if os.path.exists(db_path):
+            store = CorpusStore(db_path)
+            digest.update(store.fingerprint().encode("utf-8"))
+            store.close()
+        for filename in sorted(os.listdir(folder)):
+            if is_document_file(filename):
+                stat = os.stat(os.path.join(folder, filename))
+                digest.update(f"{filename}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+        return index_fingerprint(digest.hexdigest(), embedding_version)
+
+    def split_documents(self, doc_list, executor=None):
+        from rag_index import SplitCache, create_text_splitter
+        text_splitter = create_text_splitter()
+        split_cache = SplitCache()
+        doc_splits = split_cache.split_documents(text_splitter, doc_list, executor)
+        split_cache.close()
+        return doc_splits
+
+    def ingest_executor(self):
+        workers = int(os.getenv("RAG_INGEST_WORKERS", 1))
+        if workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+            return None
+        # fork, as spawn and forkserver would re-import app.py as __main__ and start a second RAG system in every worker
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+        # a fork pool launches every worker synchronously on its first submit, so they are forked here rather than mid warm-up
+        executor.submit(os.getpid)
+        return executor
 
     def setup_embeddings(self):
-        model_name = "Alibaba-NLP/gte-large-en-v1.5"
-        model_kwargs = {'device': 'cuda', "trust_remote_code": True}
-        return HuggingFaceEmbeddings(
-            model_name=model_name,
-            model_kwargs=model_kwargs,
-        )
-
-    def setup_vectorstore(self, doc_splits):
-        hf = self.setup_embeddings()
-        if os.path.exists("./chroma_db"):
-            self.vectorstore = Chroma(persist_directory="./chroma_db", collection_name="rag-chroma", embedding_function=hf)
-            print("Vector database loaded")
-        else:
-            self.vectorstore = Chroma.from_documents(
-                documents=doc_splits,
-                collection_name="rag-chroma",
-                embedding=hf,
-                persist_directory="./chroma_db",
-            )
-            self.vectorstore.persist()
-            print("Vector database created")
-
-    def setup_retriever(self):
+        from rag_index import setup_embeddings
+        return setup_embeddings()
+
+    def setup_vectorstore(self, embeddings, doc_splits):
+        from rag_index import CHROMA_DIR, open_vectorstore, sync_vectorstore
+        created = not os.path.exists(CHROMA_DIR)
+        self.vectorstore = open_vectorstore(embeddings)
+        # only new or changed chunks are embedded, stale ones are deleted
+        sync_vectorstore(self.vectorstore, doc_splits)
+        self.vectorstore.persist()
+        print("Vector database created" if created else "Vector database synced")
+
+    def setup_retriever(self, folder):
+        # heavy, so imported here in the warm-up thread rather than at startup
+        from retrievers import create_multi_query_retriever, create_self_query_retriever
+        from med_matcher import MedicationMatcher
+        self.matcher = MedicationMatcher.from_folder(folder)
         self.retriever = self.vectorstore.as_retriever()
+        self.multi_retriever = create_multi_query_retriever(self.local_llm, self.retriever)
+        self.self_retriever = create_self_query_retriever(self.local_llm, self.vectorstore)
+        # shared by all requests so concurrent retrieval stays bounded
+        self.branch_executor = ThreadPoolExecutor(max_workers=int(os.getenv("RETRIEVE_BRANCH_WORKERS", 8)), thread_name_prefix="retrieve")
+
+    def warm_up(self):
+        """Run in a background thread so Flask can bind and answer health checks while models load."""
+        start = time.monotonic()
+        try:
+            self.local_llm = self.setup_llm()
+            self.run()
+            self.setup_reranker()
+        except Exception as e:
+            self.error = e
+            print(f"Warm-up failed: {e}")
+            raise
+        self.ready.set()
+        print(f"Warm-up complete in {time.monotonic() - start:.1f}s, ready for requests")
+
+    def setup_reranker(self):
+        # loaded once here rather than by every request to rank_documents
+        from reranker import Reranker
+        self.reranker = Reranker()
 
     def run(self):
+        from rag_index import open_vectorstore, index_is_current, mark_index_current
         folder = "testdata/NHSmed"
-        doc_list = self.load_documents(folder)
-        doc_splits = self.split_documents(doc_list)
-        self.setup_vectorstore(doc_splits)
-        self.setup_retriever()
+        executor, self.ingest_pool = self.ingest_pool, None
+        try:
+            embeddings = self.setup_embeddings()
+            # revision and backend as well, vectors from a different backend can't be mixed with the stored ones
+            fingerprint = self.corpus_fingerprint(folder, embeddings.revision)
+            current = index_is_current(fingerprint)
+            if not current:
+                doc_list = self.load_documents(folder, executor)
+                doc_splits = self.split_documents(doc_list, executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        if current:
+            # nothing changed since the index was last synced, no need to load or split the corpus
+            self.vectorstore = open_vectorstore(embeddings)
+            print("Vector database loaded, index is current")
+        else:
+            self.setup_vectorstore(embeddings, doc_splits)
+            mark_index_current(fingerprint)
+        self.setup_retriever(folder)
 
 
 ##################
@@ -149,6 +249,7 @@ class AgentState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], add_messages]
     rewrite_question: BaseMessage # store, not append, the reworded question for access without indexing
     documents: List[Document] # same for retrieved documents
+    timings: dict # seconds spent in each retrieval branch, for latency tuning
     # failed: int # default failed, updated by grader
         
 from typing import Annotated, Literal, Sequence, TypedDict
@@ -228,10 +329,6 @@ def pretty_print_docs(docs):
         )
     )
 
-from langchain.retrievers.multi_query import MultiQueryRetriever
-from langchain.chains.query_constructor.base import AttributeInfo
-from langchain.retrievers.self_query.base import SelfQueryRetriever
-
 def retrieve(state):
     """
     Retrieve documents
@@ -242,48 +339,27 @@ def retrieve(state):
     Returns:
         state (dict): New key added to state, documents, that contains retrieved documents
     """
+    from retrievers import expand_and_search, self_query_or_match, timed # loaded during warm-up
+
     print("---RETRIEVE---")
     question = state["rewrite_question"]
     messages = state["messages"]
 
-    # Query Expansion Retrieval
-    multi_retriever = MultiQueryRetriever.from_llm(
-    retriever=RAGSystem.retriever, llm=RAGSystem.local_llm
-    )
-    
-    # Self Query + Filtered Search
-    metadata_field_info = [
-        AttributeInfo(
-            name="med_name",
-            description="Name of the medication. If a common brand name exists it may be in brackets after",
-            type="string"
-        ),
-        AttributeInfo(
-            name="document_description", 
-            description="The specific topics about the medication",
-            type="string"
-        ),
-        AttributeInfo(
-            name="page_description", 
-            description="What conditions the medication is used to treat. May contain alternated brand names",
-            type="string"
-        ),
-    ]
-    document_content_description = "Information about a specific medication"
-    self_retriever = SelfQueryRetriever.from_llm(
-        RAGSystem.local_llm,
-        RAGSystem.vectorstore,
-        document_content_description,
-        metadata_field_info,
-    )
+    # built once during warm-up, see InitialiseRAG.setup_retriever
+    multi_retriever = RAGSystem.multi_retriever
+    self_retriever = RAGSystem.self_retriever
     
-    # Run Retrievers
-    multi_documents = multi_retriever.invoke(question.content)
-    print(f"\n Query Expansion: {len(multi_documents)} Documents Returned \n")
+    # Run Retrievers concurrently, query expansion makes an LLM round trip before searching, self query only when no medicine name matches
+    start = time.perf_counter()
+    multi_future = RAGSystem.branch_executor.submit(timed, expand_and_search, multi_retriever, question.content, RAGSystem.vectorstore)
+    self_future = RAGSystem.branch_executor.submit(timed, self_query_or_match, RAGSystem.matcher, self_retriever, question.content)
+    multi_documents, multi_seconds = multi_future.result()
+    print(f"\n Query Expansion: {len(multi_documents)} Documents Returned in {multi_seconds:.2f}s \n")
     #pretty_print_docs(multi_documents)
-    self_documents = self_retriever.invoke(question.content)
-    print(f"\n Self Query + Filter: {len(self_documents)} Documents Returned \n")
+    self_documents, self_seconds = self_future.result()
+    print(f"\n Self Query + Filter: {len(self_documents)} Documents Returned in {self_seconds:.2f}s \n")
     #pretty_print_docs(self_documents)
+    timings = {"query_expansion": multi_seconds, "self_query": self_seconds, "retrieve": time.perf_counter() - start}
     
     # Combine docs and deduplicate
     documents = []
@@ -293,7 +369,7 @@ def retrieve(state):
             metadata_set.add(doc.page_content)
             documents.append(doc)
     print(f"\n UNIQUE DOCUMENTS: {len(metadata_set)} \n")
-    return {"documents": documents, "rewrite_question": question, "messages": messages}
+    return {"documents": documents, "rewrite_question": question, "messages": messages, "timings": timings}
 
 def reject(state):
     """
@@ -428,8 +504,6 @@ def grade_documents(state):
             continue
     return {"documents": filtered_docs, "rewrite_question": question, "failed": failed, "messages": messages}
 
-from langchain_community.document_compressors import FlashrankRerank
-
 def rank_documents(state):
     """
     Reranks the documents according to relevance to original question 
@@ -440,17 +514,17 @@ def rank_documents(state):
     Returns:
         state (dict): Updates documents key with only top relevant documents
     """
-    
+
     print("---RANKING DOCUMENT RELEVANCE TO QUESTION---")
     
     question = state["rewrite_question"]
     documents = state["documents"]
     messages = state["messages"]
-    # Use FlashrankRerank to rank and return top n relevant documents
-    reranker = FlashrankRerank(top_n=4)
-    reranked_docs = reranker.compress_documents(documents=documents, query=question.content) 
+    # Use the shared FlashRank model to rank and return top n relevant documents
+    reranked_docs = RAGSystem.reranker.rerank(documents, question.content)
 
     print(f"\n Returning top {len(reranked_docs)} out of {len(documents)} Documents \n")
+    print(f"Rerank score cache: {RAGSystem.reranker.cache.stats()}")
 
     return {"documents": reranked_docs, "rewrite_question": question, "messages": messages}
 
@@ -508,9 +582,9 @@ def generate(state):
 
 from langgraph.graph import END, StateGraph
 
-# Setup LLM and vectorDB
+# Setup LLM now, load the embedder and vectorDB in the background so Flask binds immediately
 RAGSystem = InitialiseRAG()
-RAGSystem.run()
+threading.Thread(target=RAGSystem.warm_up, name="warm-up", daemon=True).start()
 
 # Define a new graph
 workflow = StateGraph(AgentState)
@@ -551,6 +625,7 @@ graph = workflow.compile()
 # Test w/ console output
 def test_run():
     import pprint
+    RAGSystem.ready.wait()
     inputs = {
         "messages": [
             ("user", ""),
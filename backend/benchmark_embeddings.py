@@ -0,0 +1,48 @@
+import os, sys, time, argparse
+from corpus import CORPUS_DB, CorpusStore
+from rag_index import EMBEDDING_BACKENDS, create_embedding_model, create_text_splitter
+
+def load_sample(folder, size):
+    store = CorpusStore(os.path.join(folder, CORPUS_DB))
+    docs = []
+    for doc in store.iter_documents():
+        docs.append(doc)
+        if len(docs) >= size:
+            break
+    store.close()
+    return [doc.page_content for doc in create_text_splitter().split_documents(docs)][:size]
+
+def benchmark(backend, texts, queries):
+    try:
+        model = create_embedding_model(backend)
+    except Exception as e:
+        print(f"{backend}: unavailable ({e})")
+        return
+    model.embed_documents(texts[:8]) # warm up kernels and lazy allocation
+    start = time.perf_counter()
+    model.embed_documents(texts)
+    documents_per_second = len(texts) / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for query in queries:
+        model.embed_query(query)
+    queries_per_second = len(queries) / (time.perf_counter() - start)
+    print(f"{backend}: {documents_per_second:.1f} document embeddings/s, {queries_per_second:.1f} query embeddings/s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding throughput of each backend on chunks of the scraped corpus")
+    parser.add_argument("--folder", default="testdata/NHSmed")
+    parser.add_argument("--size", type=int, default=256, help="number of chunks to embed")
+    parser.add_argument("--backends", default=",".join(EMBEDDING_BACKENDS))
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.folder, CORPUS_DB)):
+        print(f"No corpus found in {args.folder}, run NHS-medicines-scraper.py first")
+        sys.exit(1)
+    texts = load_sample(args.folder, args.size)
+    queries = ["What are the side effects of sertraline?", "Can I drink alcohol with amoxicillin?", "How long does it take for omeprazole to work?"] * 10
+    print(f"Embedding {len(texts)} chunks and {len(queries)} queries")
+    for backend in args.backends.split(","):
+        benchmark(backend, texts, queries)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import os, re, sys, argparse, subprocess
+
+# "import time: self [us] | cumulative | imported package"
+IMPORT_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+# app.py starts its warm-up thread on import, whose imports would otherwise be counted as startup
+NO_THREADS = "import threading; threading.Thread.start = lambda self: None; "
+
+def import_times(module, threads=False, timeout=120):
+    """Run `python -X importtime -c "import module"` in a fresh interpreter and parse its report."""
+    try:
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"{'' if threads else NO_THREADS}import {module}"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            # no ingest pool, its workers would be forked on import and are only used by warm-up
+            env={**os.environ, "RAG_INGEST_WORKERS": "1"},
+            capture_output=True,
+            text=True,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        print(f"import {module} did not finish within {timeout}s")
+        return []
+    entries = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    if result.returncode != 0:
+        print(result.stderr.splitlines()[-1] if result.stderr else f"import {module} failed")
+    return entries
+
+def main():
+    parser = argparse.ArgumentParser(description="Report where the import time of a backend module goes, using python -X importtime")
+    parser.add_argument("--module", default="app", help="module to import, app measures Flask startup until it can bind")
+    parser.add_argument("--top", type=int, default=25, help="number of packages to list")
+    parser.add_argument("--depth", type=int, default=1, help="only list packages imported at most this many levels deep")
+    parser.add_argument("--threads", action="store_true", help="let threads started during the import run, so the warm-up's imports are counted too")
+    args = parser.parse_args()
+
+    entries = import_times(args.module, args.threads)
+    if not entries:
+        sys.exit(1)
+    total = sum(self_us for _, self_us, _, _ in entries)
+    print(f"import {args.module}: {total / 1e6:.2f}s total across {len(entries)} modules\n")
+    print(f"{'cumulative':>12} {'self':>10}  package")
+    shallow = [entry for entry in entries if entry[3] <= args.depth]
+    for name, self_us, cumulative_us, depth in sorted(shallow, key=lambda entry: entry[2], reverse=True)[:args.top]:
+        print(f"{cumulative_us / 1e3:>10.1f}ms {self_us / 1e3:>8.1f}ms  {'  ' * depth}{name}")
+
+if __name__ == "__main__":
+    main()
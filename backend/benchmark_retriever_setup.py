@@ -0,0 +1,40 @@
+import time, argparse
+from langchain_community.llms.fake import FakeListLLM
+from langchain_community.embeddings import FakeEmbeddings
+from langchain_community.vectorstores import Chroma
+from retrievers import create_multi_query_retriever, create_self_query_retriever
+
+def time_per_call(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-request cost of building the retrievers versus reusing the ones built at warm-up")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    # offline stand-ins, construction never calls the LLM or embeds anything
+    llm = FakeListLLM(responses=[""])
+    vectorstore = Chroma(collection_name="benchmark-retriever-setup", embedding_function=FakeEmbeddings(size=8))
+    retriever = vectorstore.as_retriever()
+
+    def build_per_request():
+        create_multi_query_retriever(llm, retriever)
+        create_self_query_retriever(llm, vectorstore)
+
+    multi_retriever = create_multi_query_retriever(llm, retriever)
+    self_retriever = create_self_query_retriever(llm, vectorstore)
+
+    def reuse():
+        return multi_retriever, self_retriever
+
+    built = time_per_call(build_per_request, args.repeat)
+    reused = time_per_call(reuse, args.repeat)
+    print(f"Build per request: {built * 1e3:.3f}ms per request")
+    print(f"Reuse from warm-up: {reused * 1e6:.3f}us per request")
+    print(f"Saved per request: {(built - reused) * 1e3:.3f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import io, os, re, json, sqlite3, hashlib, threading
+from langchain.docstore.document import Document
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CORPUS_DB = "corpus.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS medicines (
+    name TEXT PRIMARY KEY,
+    url TEXT,
+    description TEXT,
+    alternate_names TEXT,
+    date_modified TEXT,
+    content_hash TEXT,
+    markdown TEXT
+);
+CREATE TABLE IF NOT EXISTS sections (
+    id INTEGER PRIMARY KEY,
+    med_name TEXT NOT NULL REFERENCES medicines(name) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    document_description TEXT,
+    page_content TEXT NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sections_med_name ON sections(med_name, position);
+CREATE VIRTUAL TABLE IF NOT EXISTS sections_fts USING fts5(
+    med_name, alternate_names, document_description, page_content,
+    tokenize = 'porter unicode61'
+);
+"""
+
+class CorpusStore:
+    """SQLite store of scraped medications and their section Documents, with an FTS5 keyword index."""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock() # one connection shared by the scraper's worker threads
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+
+    def upsert_medicine(self, name, url, description, alternate_names, date_modified, markdown, documents):
+        content_hash = hashlib.sha256(markdown.encode("utf-8")).hexdigest()
+        with self.lock, self.conn:
+            self._delete(name)
+            self.conn.execute(
+                "INSERT INTO medicines VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (name, url, description, alternate_names, date_modified, content_hash, markdown),
+            )
+            for position, doc in enumerate(documents):
+                cursor = self.conn.execute(
+                    "INSERT INTO sections (med_name, position, document_description, page_content, metadata) VALUES (?, ?, ?, ?, ?)",
+                    (name, position, doc.metadata.get("document_description"), doc.page_content, json.dumps(doc.metadata, ensure_ascii=False)),
+                )
+                self.conn.execute(
+                    "INSERT INTO sections_fts (rowid, med_name, alternate_names, document_description, page_content) VALUES (?, ?, ?, ?, ?)",
+                    (cursor.lastrowid, name, alternate_names, doc.metadata.get("document_description"), doc.page_content),
+                )
+
+    def delete_medicine(self, name):
+        with self.lock, self.conn:
+            self._delete(name)
+
+    def _delete(self, name):
+        self.conn.execute("DELETE FROM sections_fts WHERE rowid IN (SELECT id FROM sections WHERE med_name = ?)", (name,))
+        self.conn.execute("DELETE FROM sections WHERE med_name = ?", (name,))
+        self.conn.execute("DELETE FROM medicines WHERE name = ?", (name,))
+
+    def medicine_names(self):
+        return [name for (name,) in self.conn.execute("SELECT name FROM medicines ORDER BY name")]
+
+    def iter_documents(self, names=None):
+        """Yield every section (or those of the given medicines) as a Document, streaming rows rather than loading the table."""
+        if names is None:
+            cursor = self.conn.execute("SELECT page_content, metadata FROM sections ORDER BY med_name, position")
+        else:
+            cursor = self.conn.execute(
+                f"SELECT page_content, metadata FROM sections WHERE med_name IN ({','.join('?' * len(names))}) ORDER BY med_name, position",
+                names,
+            )
+        for page_content, metadata in cursor:
+            yield Document(page_content=page_content, metadata=json.loads(metadata))
+
+    def search(self, query, limit=10):
+        """Keyword search over section text, medication and alternate names, best BM25 match first."""
+        match = fts_query(query)
+        if not match:
+            return []
+        cursor = self.conn.execute(
+            "SELECT sections.page_content, sections.metadata FROM sections_fts "
+            "JOIN sections ON sections.id = sections_fts.rowid "
+            "WHERE sections_fts MATCH ? ORDER BY bm25(sections_fts) LIMIT ?",
+            (match, limit),
+        )
+        return [Document(page_content=page_content, metadata=json.loads(metadata)) for page_content, metadata in cursor]
+
+    def fingerprint(self):
+        """Changes whenever a medicine is added, removed or re-scraped with different content."""
+        digest = hashlib.sha256()
+        for name, date_modified, content_hash in self.conn.execute("SELECT name, date_modified, content_hash FROM medicines ORDER BY name"):
+            digest.update(f"{name}\0{date_modified}\0{content_hash}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    def close(self):
+        self.conn.close()
+
+def fts_query(text):
+    # each word as an FTS5 string so hyphens and punctuation in questions ("co-codamol", "sertraline?") aren't
+    # read as query syntax, OR'd so BM25 ranks sections by how many of the words they contain
+    words = dict.fromkeys(re.findall(r'[^\s"]+', text))
+    return " OR ".join(f'"{word}"' for word in words)
+
+def load_medicines(db_path, names):
+    """Documents for a batch of medicines over a connection of its own, so it can run in a worker process."""
+    store = CorpusStore(db_path)
+    docs = list(store.iter_documents(names))
+    store.close()
+    return docs
+
+# Per-medication files written by earlier versions of the scraper, one JSON record per section
+DOCUMENT_EXTENSIONS = (".jsonl", ".jsonl.zst")
+
+def is_document_file(filename):
+    return filename.endswith(DOCUMENT_EXTENSIONS) or (filename.endswith(".json") and filename != "medication_table.json")
+
+def load_document_file(file_path):
+    """Documents from one per-medication file, or None if it can't be read."""
+    filename = os.path.basename(file_path)
+    try:
+        if file_path.endswith(DOCUMENT_EXTENSIONS):
+            return list(iter_documents(file_path))
+        # oldest format, a dict of Document JSON strings
+        doc_list = []
+        with open(file_path, 'r') as json_file:
+            dict = json.load(json_file)
+            for obj in dict.values():
+                obj = json.loads(obj)
+                doc = Document(**obj)
+                doc_list.append(doc)
+        return doc_list
+    except FileNotFoundError:
+        print(f"Error: Medication file not found: {filename}")
+    except json.JSONDecodeError:
+        print(f"Error: Invalid JSON format in medication file: {filename}")
+    return None
+
+def iter_documents(path):
+    """Yield Documents one record at a time without loading the whole file."""
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError("zstandard is required for compressed documents, pip install zstandard")
+        with open(path, 'rb') as doc_file:
+            with io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(doc_file), encoding="utf-8") as lines:
+                for line in lines:
+                    yield Document(**json.loads(line))
+    else:
+        with open(path, 'r', encoding='utf-8') as lines:
+            for line in lines:
+                yield Document(**json.loads(line))
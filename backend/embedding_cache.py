@@ -0,0 +1,149 @@
+import os, re, json, hashlib, threading, unicodedata
+from contextlib import contextmanager
+import numpy as np
+try:
+    import fcntl
+except ImportError:
+    fcntl = None # no flock on Windows, keep one cache folder per process there
+from langchain_core.embeddings import Embeddings
+
+def text_hash(text):
+    # normalise so whitespace and unicode form differences between scrapes still hit
+    normalised = re.sub(r'\s+', ' ', unicodedata.normalize("NFC", text)).strip()
+    return hashlib.sha256(normalised.encode("utf-8")).hexdigest()
+
+class CachedEmbeddings(Embeddings):
+    """
+    Persistent cache in front of an embedding model, shared by document and query embedding.
+
+    Vectors are appended to a float32 file that is read back through a memory map, and row numbers are
+    looked up from an append-only list of text hashes. Each model and revision gets its own folder, which
+    several processes can share: appends hold a file lock and first read in rows other processes added.
+    """
+    def __init__(self, embeddings, model_name, revision, folder="./embedding_cache"):
+        self.embeddings = embeddings
+        self.revision = revision
+        self.folder = os.path.join(folder, f"{model_name.replace('/', '--')}@{revision}")
+        self.vectors_path = os.path.join(self.folder, "vectors.f32")
+        self.hashes_path = os.path.join(self.folder, "hashes.txt")
+        self.meta_path = os.path.join(self.folder, "meta.json")
+        self.lock_path = os.path.join(self.folder, "lock")
+        os.makedirs(self.folder, exist_ok=True)
+        self.lock = threading.Lock()
+        self.dim = None
+        self.rows = {}
+        self.count = 0 # rows on disk, numbered in file order
+        self.hashes_offset = 0 # bytes of hashes.txt already read
+        self.vectors = None
+        self.hits = 0
+        self.misses = 0
+        with self.lock, self._file_lock():
+            self._sync()
+        if self.rows:
+            print(f"Embedding cache loaded: {len(self.rows)} vectors from {self.folder}")
+
+    @contextmanager
+    def _file_lock(self):
+        # the scraper's indexer and any number of app workers can share one folder, only one appends at a time
+        with open(self.lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _sync(self):
+        """Pick up rows appended by other processes since the last sync, called with both locks held."""
+        if self.dim is None:
+            if not os.path.exists(self.meta_path):
+                return
+            with open(self.meta_path, 'r', encoding='utf-8') as json_file:
+                self.dim = json.load(json_file)["dim"]
+        with open(self.hashes_path, 'ab+') as hashes_file:
+            hashes_file.seek(self.hashes_offset)
+            lines = hashes_file.read().split(b"\n")
+        partial = lines.pop() # empty unless a writer died mid-line
+        row_bytes = 4 * self.dim
+        vector_bytes = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        complete = max(self.count, min(vector_bytes // row_bytes, self.count + len(lines)))
+        if partial or complete < self.count + len(lines) or vector_bytes != complete * row_bytes:
+            # a writer that crashed mid-append can leave a partial vector or hashes without vectors, trim both
+            # to the complete rows. Nobody else is appending while the lock is held
+            lines = lines[:complete - self.count]
+            with open(self.vectors_path, 'ab') as vectors_file:
+                vectors_file.truncate(complete * row_bytes)
+            with open(self.hashes_path, 'ab') as hashes_file:
+                hashes_file.truncate(self.hashes_offset + sum(len(line) + 1 for line in lines))
+        for line in lines:
+            self.rows[line.decode("ascii")] = self.count
+            self.count += 1
+        self.hashes_offset += sum(len(line) + 1 for line in lines)
+        if lines:
+            self._map()
+
+    def _map(self):
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r').reshape(-1, self.dim) if self.count else None
+
+    def _store(self, hashes, vectors):
+        with self.lock, self._file_lock():
+            self._sync()
+            if self.dim is None:
+                self.dim = len(vectors[0])
+                with open(self.meta_path, 'w', encoding='utf-8') as json_file:
+                    json.dump({"dim": self.dim}, json_file)
+            fresh = list({hash: vector for hash, vector in zip(hashes, vectors) if hash not in self.rows}.items())
+            if not fresh:
+                return
+            # row numbers come from the files, which the lock keeps in step, not from what this process has stored
+            with open(self.vectors_path, 'ab') as vectors_file:
+                vectors_file.write(np.asarray([vector for _, vector in fresh], dtype=np.float32).tobytes())
+            lines = "".join(f"{hash}\n" for hash, _ in fresh).encode("ascii")
+            with open(self.hashes_path, 'ab') as hashes_file:
+                hashes_file.write(lines)
+            for hash, _ in fresh:
+                self.rows[hash] = self.count
+                self.count += 1
+            self.hashes_offset += len(lines)
+            self._map()
+
+    def _lookup(self, hashes):
+        with self.lock:
+            vectors = self.vectors
+            return [self.rows.get(hash) for hash in hashes], vectors
+
+    def embed_documents(self, texts):
+        hashes = [text_hash(text) for text in texts]
+        rows, vectors = self._lookup(hashes)
+        missing = [i for i, row in enumerate(rows) if row is None]
+        # the same text can appear twice in one call, only embed it once
+        to_embed = list(dict.fromkeys(hashes[i] for i in missing))
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        embedded = {}
+        if to_embed:
+            first = {hashes[i]: texts[i] for i in reversed(missing)}
+            new_vectors = self.embeddings.embed_documents([first[hash] for hash in to_embed])
+            embedded = dict(zip(to_embed, new_vectors))
+            self._store(to_embed, new_vectors)
+        return [list(embedded[hash]) if row is None else vectors[row].tolist() for hash, row in zip(hashes, rows)]
+
+    def embed_query(self, text):
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts):
+        """Embed several queries, all cache misses go to the model in a single batch."""
+        # queries get their own key as some models embed queries and documents differently
+        hashes = [text_hash("query: " + text) for text in texts]
+        rows, vectors = self._lookup(hashes)
+        missing = [i for i, row in enumerate(rows) if row is None]
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        embedded = {}
+        if missing:
+            # HuggingFaceEmbeddings.embed_query is embed_documents of a single text, so batching gives the same vectors
+            new_vectors = self.embeddings.embed_documents([texts[i] for i in missing])
+            embedded = {i: list(vector) for i, vector in zip(missing, new_vectors)}
+            self._store([hashes[i] for i in missing], new_vectors)
+        return [embedded[i] if row is None else vectors[row].tolist() for i, row in enumerate(rows)]
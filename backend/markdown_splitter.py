@@ -0,0 +1,75 @@
+import re
+from functools import lru_cache
+import tiktoken
+from langchain.docstore.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+# "## headline\n\n**description**\n\n" as written by NHSMedicationAPI._create_paragraph_header, headline optional
+SECTION_HEADER = re.compile(r'((?:## [^\n]*\n\n)?(?:\*\*.*?\*\*\n\n)?)(.*)', re.S)
+# each paragraph with a subheading starts "### subhead" (NHSMedicationAPI._process_paragraph)
+SUBHEADING = re.compile(r'(?m)^(?=### )')
+
+class MarkdownSectionSplitter:
+    """
+    Chunks the scraper's section Markdown on its ### subheading boundaries, packing whole subsections
+    into chunks of up to chunk_size tokens and repeating the section heading at the top of each one.
+    Token counts are cached per subsection, and only a subsection too long on its own is split further by
+    the token-counting splitter.
+    """
+    def __init__(self, encoding_name="gpt2", chunk_size=512, chunk_overlap=64):
+        self.encoding_name = encoding_name
+        self.encoding = tiktoken.get_encoding(encoding_name)
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.fallbacks = {}
+        # paragraphs repeat across sections and rebuilds, count each distinct one once
+        self.count_tokens = lru_cache(maxsize=65536)(self._count_tokens)
+
+    def _count_tokens(self, text):
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def _fallback(self, budget):
+        if budget not in self.fallbacks:
+            self.fallbacks[budget] = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+                encoding_name=self.encoding_name,
+                chunk_size=budget,
+                chunk_overlap=min(self.chunk_overlap, budget // 4),
+            )
+        return self.fallbacks[budget]
+
+    def split_text(self, text):
+        if not text.strip():
+            return []
+        parts = SUBHEADING.split(text)
+        heading, lead = SECTION_HEADER.match(parts[0]).groups()
+        units = ([lead] if lead.strip() else []) + parts[1:]
+        # sized from the cached per-unit counts, so an unchanged paragraph is never tokenised twice. Joined units
+        # can tokenise their "\n\n###" boundary one token longer than apart, so each unit is allowed one extra
+        heading_tokens = self.count_tokens(heading)
+        if heading_tokens + sum(self.count_tokens(unit) + 1 for unit in units) <= self.chunk_size:
+            return [text.strip()]
+
+        budget = self.chunk_size - heading_tokens
+        if budget < self.chunk_size // 4:
+            # heading too long to repeat in every chunk
+            units = [heading] + units
+            heading, budget = "", self.chunk_size
+
+        chunks = []
+        current, current_tokens = [], 0
+        for unit in units:
+            tokens = self.count_tokens(unit) + 1
+            if current and current_tokens + tokens > budget:
+                chunks.append(heading + "".join(current))
+                current, current_tokens = [], 0
+            if tokens > budget:
+                chunks.extend(heading + piece for piece in self._fallback(budget).split_text(unit))
+            else:
+                current.append(unit)
+                current_tokens += tokens
+        if current:
+            chunks.append(heading + "".join(current))
+        return [chunk.strip() for chunk in chunks]
+
+    def split_documents(self, docs):
+        return [Document(page_content=text, metadata=dict(doc.metadata)) for doc in docs for text in self.split_text(doc.page_content)]
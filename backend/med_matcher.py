@@ -0,0 +1,144 @@
+import os
+import re
+import json
+import difflib
+import unicodedata
+from corpus import CORPUS_DB, CorpusStore
+
+# words that appear in brand and product names but say nothing about which medicine is meant
+STOPWORDS = {
+    "a", "an", "and", "for", "of", "the", "to", "in", "on", "with", "or", "is", "can", "i", "my", "take",
+    "adult", "adults", "child", "children", "tablet", "tablets", "capsule", "capsules", "liquid", "cream",
+    "gel", "spray", "drops", "injection", "plus", "extra", "max", "advance", "relief", "cold", "flu", "pain",
+    "strength", "original", "rapid", "express", "fast", "forte", "once", "daily", "night", "day",
+}
+# only words at least this long are corrected for misspelling
+MIN_FUZZY_LENGTH = 5
+FUZZY_CUTOFF = 0.85
+
+def tokenize(text):
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii").lower()
+    return re.findall(r"[a-z0-9]+", text)
+
+class MedicationMatcher:
+    """
+    Finds medicines named in a question without an LLM call, and turns them into metadata filters.
+
+    Canonical names, any brand name in brackets after them and the words of each medicine's alternate
+    names go into a trie over words, which is scanned once for the longest match at each position. Single
+    word names the question only nearly spells, such as "sertaline", are corrected with difflib.
+    """
+    def __init__(self, aliases, descriptions=None):
+        self.trie = {}
+        self.vocabulary = {}
+        for alias, names in aliases.items():
+            self._add(alias, names)
+        # section titles per medicine, "side effects", "pregnancy breastfeeding and fertility"
+        self.descriptions = descriptions or {}
+        print(f"Medication matcher built: {len(aliases)} names and aliases")
+
+    def _add(self, alias, names):
+        tokens = tokenize(alias)
+        if not tokens:
+            return
+        node = self.trie
+        for token in tokens:
+            node = node.setdefault(token, {})
+        node.setdefault(None, set()).update(names)
+        if len(tokens) == 1 and len(tokens[0]) >= MIN_FUZZY_LENGTH:
+            self.vocabulary.setdefault(tokens[0], set()).update(names)
+
+    @classmethod
+    def from_folder(cls, folder):
+        """Names, alternate names and section titles from the scraper's corpus database, else its medication_table.json."""
+        aliases, descriptions = {}, {}
+        db_path = os.path.join(folder, CORPUS_DB)
+        table_path = os.path.join(folder, "medication_table.json")
+        if os.path.exists(db_path):
+            store = CorpusStore(db_path)
+            medicines = list(store.conn.execute("SELECT name, alternate_names FROM medicines"))
+            for name, description in store.conn.execute("SELECT DISTINCT med_name, document_description FROM sections"):
+                if description:
+                    descriptions.setdefault(name, set()).add(description)
+            store.close()
+        elif os.path.exists(table_path):
+            with open(table_path, 'r', encoding='utf-8') as json_file:
+                medicines = [(med["name"], "") for med in json.load(json_file)["data"]]
+        else:
+            medicines = []
+
+        # alternate names are stored space joined, so brand names can only be matched word by word.
+        # Words shared by several medicines ("Extra", "Children") are left out as ambiguous
+        alternate_words = {}
+        for name, alternate_names in medicines:
+            for word in set(tokenize(alternate_names or "")):
+                if len(word) >= 4 and word not in STOPWORDS:
+                    alternate_words.setdefault(word, set()).add(name)
+
+        for name, _ in medicines:
+            for alias in cls.name_aliases(name):
+                aliases.setdefault(alias, set()).add(name)
+        for word, names in alternate_words.items():
+            if len(names) <= 2:
+                aliases.setdefault(word, set()).update(names)
+        return cls(aliases, descriptions)
+
+    @staticmethod
+    def name_aliases(name):
+        # "Co-codamol for adults" is also asked about as "co-codamol" and "cocodamol", "Name (Brand)" by either name
+        base = re.sub(r"\s*\(.*?\)", "", name).strip()
+        aliases = {name, base, re.split(r"\s+for\s+", base)[0]}
+        aliases.update(re.findall(r"\(([^)]*)\)", name))
+        aliases.update(alias.replace("-", "") for alias in list(aliases) if "-" in alias)
+        return {alias for alias in aliases if alias and tokenize(alias) and set(tokenize(alias)) - STOPWORDS}
+
+    def match(self, question):
+        """Names of the medicines mentioned in the question, longest match first at each word."""
+        tokens = tokenize(question)
+        names = set()
+        i = 0
+        while i < len(tokens):
+            node, matched, end = self.trie, (), i + 1
+            for j in range(i, len(tokens)):
+                node = node.get(tokens[j])
+                if node is None:
+                    break
+                if None in node:
+                    matched, end = node[None], j + 1
+            names.update(matched)
+            i = end
+        if not names:
+            # only try spelling correction when nothing matched exactly, it costs more than the trie scan
+            for token in tokens:
+                names.update(self._correct(token) or ())
+        return sorted(names)
+
+    def _correct(self, token):
+        if len(token) < MIN_FUZZY_LENGTH or token in STOPWORDS:
+            return None
+        close = difflib.get_close_matches(token, self.vocabulary, n=1, cutoff=FUZZY_CUTOFF)
+        return self.vocabulary[close[0]] if close else None
+
+    def match_descriptions(self, question, names):
+        """Section titles of the matched medicines whose words, less the medicine's own name, all appear in the question."""
+        words = set(tokenize(question))
+        matched = set()
+        for name in names:
+            name_words = set(tokenize(name))
+            for description in self.descriptions.get(name, ()):
+                topic = set(tokenize(description)) - name_words - STOPWORDS
+                if topic and topic <= words:
+                    matched.add(description)
+        return sorted(matched)
+
+    def metadata_filter(self, question):
+        """Chroma where filter on med_name, and document_description when a section is asked for, or None if no medicine matched."""
+        names = self.match(question)
+        if not names:
+            return None
+        name_filter = {"med_name": {"$eq": names[0]}} if len(names) == 1 else {"med_name": {"$in": names}}
+        descriptions = self.match_descriptions(question, names)
+        if not descriptions:
+            return name_filter
+        description_filter = {"document_description": {"$eq": descriptions[0]}} if len(descriptions) == 1 else {"document_description": {"$in": descriptions}}
+        return {"$and": [name_filter, description_filter]}
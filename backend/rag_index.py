@@ -0,0 +1,327 @@
+import os, json, queue, sqlite3, threading, time, hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.docstore.document import Document
+from langchain_community.vectorstores import Chroma
+from langchain_community.embeddings import HuggingFaceEmbeddings
+from embedding_cache import CachedEmbeddings
+from markdown_splitter import MarkdownSectionSplitter
+
+# Shared by app.py and NHS-medicines-scraper.py so both build the same index
+CHROMA_DIR = "./chroma_db"
+COLLECTION_NAME = "rag-chroma"
+
+INDEX_STATE = os.path.join(CHROMA_DIR, "index_state.json")
+SPLIT_CACHE_DB = "./split_cache.db"
+SPLITTER_SETTINGS = {"chunker": os.getenv("RAG_CHUNKER", "markdown"), "encoding_name": "gpt2", "chunk_size": 512, "chunk_overlap": 64}
+
+def create_text_splitter():
+    settings = {key: value for key, value in SPLITTER_SETTINGS.items() if key != "chunker"}
+    if SPLITTER_SETTINGS["chunker"] == "recursive":
+        return RecursiveCharacterTextSplitter.from_tiktoken_encoder(**settings)
+    return MarkdownSectionSplitter(**settings)
+
+def index_fingerprint(corpus_fingerprint, embedding_version):
+    # the index must be rebuilt if the corpus, the way it is chunked or the vectors' model, revision or backend change
+    return hashlib.sha256(json.dumps([corpus_fingerprint, SPLITTER_SETTINGS, EMBEDDING_MODEL, embedding_version], sort_keys=True).encode("utf-8")).hexdigest()
+
+def load_index_state():
+    if not os.path.exists(INDEX_STATE):
+        return {}
+    with open(INDEX_STATE, 'r', encoding='utf-8') as json_file:
+        return json.load(json_file)
+
+def save_index_state(state):
+    os.makedirs(CHROMA_DIR, exist_ok=True)
+    with open(INDEX_STATE, 'w', encoding='utf-8') as json_file:
+        json.dump(state, json_file)
+
+def index_is_current(fingerprint):
+    return load_index_state().get("fingerprint") == fingerprint
+
+def mark_index_current(fingerprint):
+    state = load_index_state()
+    state["fingerprint"] = fingerprint
+    save_index_state(state)
+
+_worker_splitter = None
+
+def split_texts(texts):
+    """Process pool entry point, each worker builds its splitter and tiktoken encoding once."""
+    global _worker_splitter
+    if _worker_splitter is None:
+        _worker_splitter = create_text_splitter()
+    return [_worker_splitter.split_text(text) for text in texts]
+
+class SplitCache:
+    """Chunks of each source Document, keyed by a hash of its content, metadata and the splitter settings."""
+    def __init__(self, path=SPLIT_CACHE_DB):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS splits (key TEXT PRIMARY KEY, chunks TEXT NOT NULL)")
+        self.settings = json.dumps(SPLITTER_SETTINGS, sort_keys=True)
+
+    def _key(self, doc):
+        return hashlib.sha256(f"{self.settings}\0{json.dumps(doc.metadata, sort_keys=True)}\0{doc.page_content}".encode("utf-8")).hexdigest()
+
+    def split_documents(self, splitter, doc_list, executor=None):
+        keys = [self._key(doc) for doc in doc_list]
+        cached = {}
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows = self.conn.execute(f"SELECT key, chunks FROM splits WHERE key IN ({','.join('?' * len(batch))})", batch)
+            cached.update((key, json.loads(chunks)) for key, chunks in rows)
+        print(f"Split cache: {len(cached)} of {len(doc_list)} documents already split")
+
+        misses = {key: doc.page_content for key, doc in zip(keys, doc_list) if key not in cached}
+        texts = list(misses.values())
+        if executor is None:
+            splits = [splitter.split_text(text) for text in texts]
+        else:
+            # tokenising is CPU bound, fan batches out to worker processes, map keeps them in order
+            batches = [texts[start:start + 8] for start in range(0, len(texts), 8)]
+            splits = [chunks for batch in executor.map(split_texts, batches) for chunks in batch]
+        with self.conn:
+            for key, chunks in zip(misses, splits):
+                cached[key] = chunks
+                self.conn.execute("INSERT OR REPLACE INTO splits VALUES (?, ?)", (key, json.dumps(chunks, ensure_ascii=False)))
+
+        # same result as splitter.split_documents, each chunk carries a copy of its parent's metadata
+        doc_splits = []
+        for key, doc in zip(keys, doc_list):
+            doc_splits.extend(Document(page_content=text, metadata=dict(doc.metadata)) for text in cached[key])
+        return doc_splits
+
+    def close(self):
+        self.conn.close()
+
+EMBEDDING_MODEL = "Alibaba-NLP/gte-large-en-v1.5"
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+ONNX_QUANTIZATION = os.getenv("EMBEDDING_ONNX_QUANTIZATION", "avx2") # arm64, avx2, avx512 or avx512_vnni
+ONNX_MODEL_DIR = "./onnx_models"
+
+def select_device():
+    import torch
+    if torch.cuda.is_available():
+        return "cuda"
+    if getattr(torch.backends, "mps", None) is not None and torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+def select_backend():
+    """EMBEDDING_BACKEND, or for auto: torch on a GPU, quantised ONNX Runtime on CPU when it is installed."""
+    backend = os.getenv("EMBEDDING_BACKEND", "auto")
+    if backend != "auto":
+        return backend
+    if select_device() != "cpu":
+        return "torch"
+    try:
+        import onnxruntime, optimum
+        return "onnx-int8"
+    except ImportError:
+        return "torch"
+
+def embedding_workers():
+    """Concurrent embed_documents calls in embed_in_buckets, one by default on CPU where a single call already uses every core."""
+    return int(os.getenv("EMBEDDING_WORKERS") or (1 if select_device() == "cpu" else 2))
+
+def create_embedding_model(backend, revision="main"):
+    """The raw embedding model for a backend, without the persistent cache."""
+    # an empty EMBEDDING_THREADS, as in sample.env, means every core, shared between the concurrent embedding workers
+    threads = max(1, int(os.getenv("EMBEDDING_THREADS") or os.cpu_count() or 1) // embedding_workers())
+    model_name = EMBEDDING_MODEL
+    model_kwargs = {"trust_remote_code": True, "revision": revision}
+    if backend == "torch":
+        import torch
+        model_kwargs["device"] = select_device()
+        if model_kwargs["device"] == "cpu":
+            torch.set_num_threads(threads)
+    elif backend in ("onnx", "onnx-int8"):
+        import onnxruntime
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = threads
+        model_kwargs.update({"device": "cpu", "backend": "onnx", "model_kwargs": {"session_options": session_options}})
+        if backend == "onnx-int8":
+            model_name = quantized_onnx_model(revision)
+            model_kwargs["model_kwargs"]["file_name"] = f"onnx/model_qint8_{ONNX_QUANTIZATION}.onnx"
+    else:
+        raise ValueError(f"Unknown EMBEDDING_BACKEND {backend}, expected auto or one of {EMBEDDING_BACKENDS}")
+    print(f"Embedding backend: {backend} on {model_kwargs['device']} ({threads} CPU threads)")
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs=model_kwargs,
+    )
+
+def quantized_onnx_model(revision):
+    # exported and dynamically quantised to int8 once, then loaded from disk
+    folder = os.path.join(ONNX_MODEL_DIR, f"{EMBEDDING_MODEL.replace('/', '--')}@{revision}")
+    if not os.path.exists(os.path.join(folder, "onnx", f"model_qint8_{ONNX_QUANTIZATION}.onnx")):
+        from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+        print(f"Exporting {EMBEDDING_MODEL} to ONNX with int8 {ONNX_QUANTIZATION} quantisation")
+        model = SentenceTransformer(EMBEDDING_MODEL, backend="onnx", trust_remote_code=True, revision=revision, device="cpu")
+        model.save(folder)
+        export_dynamic_quantized_onnx_model(model, ONNX_QUANTIZATION, folder)
+    return folder
+
+def setup_embeddings():
+    revision = os.getenv("EMBEDDING_MODEL_REVISION", "main")
+    backend = select_backend()
+    try:
+        hf = create_embedding_model(backend, revision)
+    except Exception as e:
+        # auto only picks ONNX because it is installed, the export can still fail for some model architectures
+        if backend == "torch" or os.getenv("EMBEDDING_BACKEND", "auto") != "auto":
+            raise
+        print(f"Embedding backend {backend} failed to load ({e}), falling back to torch")
+        backend = "torch"
+        hf = create_embedding_model(backend, revision)
+    # vectors differ between backends, int8 especially, so each gets its own cache
+    return CachedEmbeddings(hf, EMBEDDING_MODEL, f"{revision}-{backend}", folder=os.getenv("EMBEDDING_CACHE_DIR", "./embedding_cache"))
+
+def open_vectorstore(embeddings, batch_size=256):
+    """
+    The Chroma collection, emptied first if its vectors came from another model revision or backend.
+    Chunk ids only hash content, so a sync would otherwise keep the old vectors and mix them with new queries.
+    """
+    vectorstore = Chroma(persist_directory=CHROMA_DIR, collection_name=COLLECTION_NAME, embedding_function=embeddings)
+    state = load_index_state()
+    if state.get("embeddings") != embeddings.revision:
+        collection = vectorstore._collection
+        ids = collection.get(include=[])["ids"]
+        if ids:
+            print(f"Embeddings changed from {state.get('embeddings')} to {embeddings.revision}, re-embedding all {len(ids)} chunks")
+        for start in range(0, len(ids), batch_size):
+            collection.delete(ids=ids[start:start + batch_size])
+        # also forces the next app start to sync in full, after a scraper run that only indexed changed medicines
+        state.pop("fingerprint", None)
+        state["embeddings"] = embeddings.revision
+        save_index_state(state)
+    return vectorstore
+
+def chunk_id(doc):
+    # deterministic so an unchanged chunk keeps its id across scrapes and never needs re-embedding
+    content_hash = hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()[:16]
+    return f"{doc.metadata.get('med_name')}/{doc.metadata.get('document_description')}/{content_hash}"
+
+def unique_chunks(doc_splits):
+    chunks = {}
+    for doc in doc_splits:
+        chunks.setdefault(chunk_id(doc), doc)
+    return chunks
+
+def embed_in_buckets(embeddings, texts, batch_size=None, workers=None):
+    """Embed texts in batches of similar length across a thread pool, returning vectors in the original order."""
+    batch_size = batch_size or int(os.getenv("EMBEDDING_BATCH_SIZE", 32))
+    workers = workers or embedding_workers()
+    # neighbours in length order pad to almost the same length, longest first so stragglers are short
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+    batches = [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+    vectors = [None] * len(texts)
+    done = 0
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(embeddings.embed_documents, [texts[i] for i in batch]): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            for i, vector in zip(batch, future.result()):
+                vectors[i] = vector
+            done += len(batch)
+            elapsed = time.monotonic() - start
+            rate = done / elapsed if elapsed > 0 else 0.0
+            eta = (len(texts) - done) / rate if rate > 0 else 0.0
+            print(f"Embedded {done}/{len(texts)} chunks ({rate:.1f} chunks/s, ETA {eta:.0f}s)")
+    return vectors
+
+def sync_vectorstore(vectorstore, doc_splits, batch_size=256):
+    """Embed and add only chunks missing from the collection and delete the ones no longer in doc_splits."""
+    collection = vectorstore._collection
+    chunks = unique_chunks(doc_splits)
+    existing = set(collection.get(include=[])["ids"])
+    stale = [id for id in existing if id not in chunks]
+    new = [id for id in chunks if id not in existing]
+    for start in range(0, len(stale), batch_size):
+        collection.delete(ids=stale[start:start + batch_size])
+    vectors = embed_in_buckets(vectorstore.embeddings, [chunks[id].page_content for id in new])
+    for start in range(0, len(new), batch_size):
+        ids = new[start:start + batch_size]
+        collection.upsert(
+            ids=ids,
+            embeddings=vectors[start:start + batch_size],
+            documents=[chunks[id].page_content for id in ids],
+            metadatas=[chunks[id].metadata for id in ids],
+        )
+    print(f"Vector database sync: {len(new)} chunks added, {len(stale)} removed, {len(chunks) - len(new)} unchanged")
+
+class StreamingIndexer:
+    """Chunks, embeds and upserts medications into Chroma on background threads while the scraper is still fetching."""
+    def __init__(self, queue_size=8):
+        self.splitter = create_text_splitter()
+        self.embeddings = setup_embeddings()
+        self.vectorstore = open_vectorstore(self.embeddings)
+        # bounded queues give backpressure, scraper workers block in submit() if embedding falls behind
+        self.chunk_queue = queue.Queue(maxsize=queue_size)
+        self.embed_queue = queue.Queue(maxsize=queue_size)
+        self.upsert_queue = queue.Queue(maxsize=queue_size)
+        self.medications_indexed = 0
+        self.chunks_indexed = 0
+        self.start = time.monotonic()
+        self.threads = [threading.Thread(target=stage, daemon=True) for stage in (self._chunk, self._embed, self._upsert)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, name, docs):
+        """Queue a medication's documents for indexing, an empty list removes it from the index."""
+        self.chunk_queue.put((name, docs))
+
+    def close(self):
+        self.chunk_queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.vectorstore.persist()
+        elapsed = time.monotonic() - self.start
+        print(f"Indexed {self.chunks_indexed} chunks from {self.medications_indexed} medications in {elapsed:.1f}s")
+
+    def _chunk(self):
+        while (item := self.chunk_queue.get()) is not None:
+            name, docs = item
+            try:
+                self.embed_queue.put((name, self.splitter.split_documents(docs)))
+            except Exception as e:
+                print(f"Error occurred while splitting {name}: {e}")
+        self.embed_queue.put(None)
+
+    def _embed(self):
+        collection = self.vectorstore._collection
+        while (item := self.embed_queue.get()) is not None:
+            name, splits = item
+            try:
+                chunks = unique_chunks(splits)
+                existing = set(collection.get(ids=list(chunks), include=[])["ids"]) if chunks else set()
+                new = [id for id in chunks if id not in existing]
+                vectors = self.embeddings.embed_documents([chunks[id].page_content for id in new]) if new else []
+                self.upsert_queue.put((name, chunks, new, vectors))
+            except Exception as e:
+                print(f"Error occurred while embedding {name}: {e}")
+        self.upsert_queue.put(None)
+
+    def _upsert(self):
+        collection = self.vectorstore._collection
+        while (item := self.upsert_queue.get()) is not None:
+            name, chunks, new, vectors = item
+            try:
+                # drop chunks of the medication that no longer exist so stale sections don't linger
+                previous = collection.get(where={"med_name": name}, include=[])["ids"]
+                stale = [id for id in previous if id not in chunks]
+                if stale:
+                    collection.delete(ids=stale)
+                if new:
+                    collection.upsert(
+                        ids=new,
+                        embeddings=vectors,
+                        documents=[chunks[id].page_content for id in new],
+                        metadatas=[chunks[id].metadata for id in new],
+                    )
+                self.medications_indexed += 1
+                self.chunks_indexed += len(new)
+                print(f"Indexed {name}: {len(new)} chunks added, {len(stale)} removed, {len(chunks) - len(new)} unchanged")
+            except Exception as e:
+                print(f"Error occurred while indexing {name}: {e}")
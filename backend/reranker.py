@@ -0,0 +1,95 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from langchain.docstore.document import Document
+from langchain_community.document_compressors import FlashrankRerank
+from embedding_cache import text_hash
+
+# FlashrankRerank's own default model
+RERANK_MODEL = os.getenv("RERANK_MODEL", "ms-marco-MultiBERT-L-12")
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", 4))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", 100000))
+RERANK_CACHE_TTL = float(os.getenv("RERANK_CACHE_TTL", 24 * 60 * 60))
+
+class ScoreCache:
+    """LRU cache of rerank scores keyed by (query hash, chunk hash), entries expire after ttl seconds."""
+    def __init__(self, maxsize=RERANK_CACHE_SIZE, ttl=RERANK_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] < self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, score):
+        with self.lock:
+            self.entries[key] = (score, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+class Reranker:
+    """
+    One FlashRank model loaded at warm-up and shared by every request.
+
+    Scores are cached per query and chunk, so only pairs not seen recently go to the model. Model calls
+    are serialised with a lock, as the tokenizer the model wraps sets padding and truncation on itself
+    for each call and isn't safe to share between threads.
+    """
+    def __init__(self, model=RERANK_MODEL, top_n=RERANK_TOP_N, cache=None):
+        self.model = model
+        self.top_n = top_n
+        self.compressor = FlashrankRerank(model=model, top_n=top_n)
+        self.cache = cache if cache is not None else ScoreCache()
+        self.lock = threading.Lock()
+        print(f"Reranker loaded: {model}, top {top_n}")
+
+    def score(self, documents, query):
+        # FlashRank's request and response types, imported with the model by FlashrankRerank
+        from flashrank import RerankRequest
+        query_hash = text_hash(query)
+        keys = [(query_hash, text_hash(doc.page_content)) for doc in documents]
+        scores = [self.cache.get(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            passages = [{"id": i, "text": documents[i].page_content} for i in missing]
+            with self.lock:
+                results = self.compressor.client.rerank(RerankRequest(query=query, passages=passages))
+            for result in results:
+                scores[result["id"]] = float(result["score"])
+                self.cache.put(keys[result["id"]], scores[result["id"]])
+        return scores
+
+    def rerank(self, documents, query):
+        if not documents:
+            return []
+        scores = self.score(documents, query)
+        ranked = sorted(zip(scores, range(len(documents))), key=lambda pair: pair[0], reverse=True)[:self.top_n]
+        # same output as FlashrankRerank.compress_documents
+        return [
+            Document(page_content=documents[i].page_content, metadata={**documents[i].metadata, "relevance_score": score})
+            for score, i in ranked
+        ]
@@ -0,0 +1,84 @@
+import time
+from langchain.docstore.document import Document
+from langchain.retrievers.multi_query import MultiQueryRetriever
+from langchain.chains.query_constructor.base import AttributeInfo
+from langchain.retrievers.self_query.base import SelfQueryRetriever
+
+# Metadata the self query retriever may filter on, as written by NHSMedicationAPI._create_document
+METADATA_FIELD_INFO = [
+    AttributeInfo(
+        name="med_name",
+        description="Name of the medication. If a common brand name exists it may be in brackets after",
+        type="string"
+    ),
+    AttributeInfo(
+        name="document_description", 
+        description="The specific topics about the medication",
+        type="string"
+    ),
+    AttributeInfo(
+        name="page_description", 
+        description="What conditions the medication is used to treat. May contain alternated brand names",
+        type="string"
+    ),
+]
+DOCUMENT_CONTENT_DESCRIPTION = "Information about a specific medication"
+
+def create_multi_query_retriever(llm, retriever):
+    # Query Expansion Retrieval
+    return MultiQueryRetriever.from_llm(retriever=retriever, llm=llm)
+
+def create_self_query_retriever(llm, vectorstore):
+    # Self Query + Filtered Search
+    return SelfQueryRetriever.from_llm(
+        llm,
+        vectorstore,
+        DOCUMENT_CONTENT_DESCRIPTION,
+        METADATA_FIELD_INFO,
+    )
+
+def generate_queries(multi_retriever, question):
+    """The query expansion step of MultiQueryRetriever on its own, so the searches can be run separately."""
+    response = multi_retriever.llm_chain.invoke({"question": question})
+    lines = response["text"] if isinstance(response, dict) else response # LLMChain or runnable chain
+    queries = list(dict.fromkeys(line.strip() for line in lines if line.strip()))
+    if multi_retriever.include_original and question not in queries:
+        queries.append(question)
+    return queries
+
+def expand_and_search(multi_retriever, question, vectorstore):
+    """
+    Query expansion with every expanded query, plus the question itself, embedded in one batched call
+    and searched with a single multi-vector query against the collection.
+    """
+    queries = generate_queries(multi_retriever, question)
+    if question not in queries:
+        queries.append(question)
+    print(f"\n Query Expansion: {queries} \n")
+    vectors = vectorstore.embeddings.embed_queries(queries)
+    k = multi_retriever.retriever.search_kwargs.get("k", 4)
+    results = vectorstore._collection.query(query_embeddings=vectors, n_results=k, include=["documents", "metadatas"])
+    documents = [
+        Document(page_content=page_content, metadata=metadata or {})
+        for contents, metadatas in zip(results["documents"], results["metadatas"])
+        for page_content, metadata in zip(contents, metadatas)
+    ]
+    return multi_retriever.unique_union(documents)
+
+def self_query_or_match(matcher, self_retriever, question):
+    """
+    Filtered search using the medicines the matcher finds in the question, so most requests skip the
+    self query LLM call. The SelfQueryRetriever is only asked when no medicine matches, or the filter finds nothing.
+    """
+    metadata_filter = matcher.metadata_filter(question)
+    if metadata_filter is not None:
+        print(f"\n Matched Filter: {metadata_filter} \n")
+        documents = self_retriever.vectorstore.similarity_search(question, k=self_retriever.search_kwargs.get("k", 4), filter=metadata_filter)
+        if documents:
+            return documents
+    return self_retriever.invoke(question)
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start